@@ -1,45 +1,77 @@
+from __future__ import annotations
+
 from flask import Flask, request, jsonify, Response
-import requests
+from http.cookiejar import DefaultCookiePolicy
+import itertools
 import json
+import os
+import requests
+from requests.adapters import HTTPAdapter
+import orjson
 
 app = Flask(__name__)
 
 BACKEND_BASE_URL = "https://inference.do-ai.run/v1"
 ORIGINAL_MODEL_ID = "anthropic-claude-opus-4.5"
 REWROTE_MODEL_ID = "do-opus-4.5"
+NORMALIZED_REWRITE_MODEL_ID = REWROTE_MODEL_ID.lower().replace(' ', '-').replace('--', '-')
+EXCLUDED_RESPONSE_HEADERS = frozenset({'content-encoding', 'transfer-encoding', 'connection', 'content-length'})
+STREAM_CHUNK_SIZE = int(os.environ.get('PROXY_STREAM_CHUNK', 65536))
+# Matches gunicorn's worker_connections, so every concurrent proxied call in a
+# worker can keep its backend connection instead of discarding it.
+WORKER_CONNECTIONS = int(os.environ.get('PROXY_WORKER_CONNECTIONS', 1000))
 
-def transform_tool_use_to_text(content):
+# Shared connection pool so proxied calls reuse keep-alive connections to the
+# backend instead of paying a TCP + TLS handshake on every request.
+# The Session is shared by every client of the proxy, so it must never store
+# backend cookies and replay them on another client's request.
+SESSION = requests.Session()
+SESSION.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+# There is a single backend host, so one pool is enough.
+SESSION.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=WORKER_CONNECTIONS, max_retries=0))
+
+def transform_tool_use_to_text(content: object) -> str:
     """Transform tool_use content to natural text format."""
     if isinstance(content, str):
         return content
     if isinstance(content, list):
         text_parts = []
+        append = text_parts.append
         for item in content:
             if isinstance(item, dict):
-                if item.get('type') == 'tool_use':
+                item_type = item.get('type')
+                if item_type == 'tool_use':
                     # Skip tool_use items - they're not needed in text format
                     # The tool results will be in subsequent messages
                     continue
-                elif item.get('type') == 'text':
-                    text_parts.append(item.get('text', ''))
+                elif item_type == 'text':
+                    append(item.get('text', ''))
                 else:
-                    text_parts.append(json.dumps(item))
+                    append(json.dumps(item))
             else:
-                text_parts.append(str(item))
-        return ' '.join(text_parts) if text_parts else ''
+                append(str(item))
+        return ' '.join(text_parts)
     return str(content)
 
-def transform_messages(messages):
-    """Transform messages to ensure content is always a string."""
+def transform_messages(messages: list[dict]) -> list[dict]:
+    """Transform messages to ensure content is always a string.
+
+    The list is returned unchanged when every message already has string
+    content (or none at all), which is the common case for chat turns.
+    """
+    if all(isinstance(msg.get('content', ''), str) for msg in messages):
+        return messages
     transformed = []
     for msg in messages:
+        if isinstance(msg.get('content', ''), str):
+            transformed.append(msg)
+            continue
         new_msg = msg.copy()
-        if 'content' in new_msg:
-            new_msg['content'] = transform_tool_use_to_text(new_msg['content'])
+        new_msg['content'] = transform_tool_use_to_text(new_msg['content'])
         transformed.append(new_msg)
     return transformed
 
-def transform_tool_choice(tool_choice):
+def transform_tool_choice(tool_choice: object) -> str | None:
     """Transform tool_choice from object format to string format."""
     if tool_choice is None:
         return None
@@ -50,39 +82,75 @@ def transform_tool_choice(tool_choice):
         return choice_type if choice_type in ['none', 'auto', 'required'] else "auto"
     return "auto"
 
-def transform_tools(tools):
+def _function_tool_fields(tool):
+    func = tool['function']
+    return func.get('name', 'unknown_function'), func.get('description', ''), func.get('parameters') or func.get('input_schema')
+
+def _input_schema_tool_fields(tool):
+    return tool.get('name', 'unknown_function'), tool.get('description', ''), tool.get('input_schema')
+
+def _parameters_tool_fields(tool):
+    return tool.get('name', 'unknown_function'), tool.get('description', ''), tool.get('parameters')
+
+def _named_tool_fields(tool):
+    schema = None
+    if 'custom' in tool and isinstance(tool['custom'], dict):
+        schema = tool['custom'].get('input_schema')
+    return tool.get('name', 'unknown_function'), tool.get('description', ''), schema
+
+def _unknown_tool_fields(tool):
+    return 'unknown_function', '', None
+
+# Tool shapes in the order they are recognized: the first key present wins.
+TOOL_SHAPE_PRECEDENCE = (
+    ('function', _function_tool_fields),
+    ('input_schema', _input_schema_tool_fields),
+    ('parameters', _parameters_tool_fields),
+    ('name', _named_tool_fields),
+    ('description', _named_tool_fields),
+)
+
+def _build_tool_field_extractors():
+    """Map every combination of TOOL_SHAPE_KEYS to the extractor for that shape."""
+    extractors = {}
+    for size in range(len(TOOL_SHAPE_KEYS) + 1):
+        for present in itertools.combinations(TOOL_SHAPE_KEYS, size):
+            present = frozenset(present)
+            extractors[present] = next((extract for key, extract in TOOL_SHAPE_PRECEDENCE if key in present), _unknown_tool_fields)
+    return extractors
+
+TOOL_SHAPE_KEYS = frozenset(key for key, _ in TOOL_SHAPE_PRECEDENCE)
+TOOL_FIELD_EXTRACTORS = _build_tool_field_extractors()
+
+OPENAI_TOOL_KEYS = frozenset({'type', 'function'})
+OPENAI_FUNCTION_KEYS = frozenset({'name', 'description', 'parameters', 'strict'})
+
+def is_openai_tool(tool):
+    """Check whether a tool is already a complete OpenAI function definition.
+
+    Tools carrying any other keys are rebuilt so those keys are stripped.
+    """
+    if not isinstance(tool, dict) or tool.get('type') != 'function' or not tool.keys() <= OPENAI_TOOL_KEYS:
+        return False
+    func = tool.get('function')
+    if not isinstance(func, dict) or 'name' not in func or not func.keys() <= OPENAI_FUNCTION_KEYS:
+        return False
+    schema = func.get('parameters')
+    return isinstance(schema, dict) and 'type' in schema and 'properties' in schema
+
+def transform_tools(tools: list | None) -> list | None:
     """Transform tools to OpenAI format."""
     if not tools:
         return tools
     transformed = []
+    rebuilt = False
     for tool in tools:
-        if isinstance(tool, dict):
-            new_tool = {'type': 'function'}
-            function_data = {}
-            
-            schema = None
-            
-            if 'function' in tool:
-                func = tool['function']
-                function_data['name'] = func.get('name', 'unknown_function')
-                function_data['description'] = func.get('description', '')
-                schema = func.get('parameters') or func.get('input_schema')
-            elif 'input_schema' in tool:
-                function_data['name'] = tool.get('name', 'unknown_function')
-                function_data['description'] = tool.get('description', '')
-                schema = tool.get('input_schema')
-            elif 'parameters' in tool:
-                function_data['name'] = tool.get('name', 'unknown_function')
-                function_data['description'] = tool.get('description', '')
-                schema = tool.get('parameters')
-            elif 'name' in tool or 'description' in tool:
-                function_data['name'] = tool.get('name', 'unknown_function')
-                function_data['description'] = tool.get('description', '')
-                if 'custom' in tool and isinstance(tool['custom'], dict):
-                    schema = tool['custom'].get('input_schema')
-            else:
-                function_data['name'] = 'unknown_function'
-                function_data['description'] = ''
+        if not isinstance(tool, dict) or is_openai_tool(tool):
+            transformed.append(tool)
+        else:
+            rebuilt = True
+            extract = TOOL_FIELD_EXTRACTORS[TOOL_SHAPE_KEYS.intersection(tool)]
+            name, description, schema = extract(tool)
             
             if not isinstance(schema, dict):
                 schema = {'type': 'object', 'properties': {}}
@@ -91,58 +159,82 @@ def transform_tools(tools):
             if 'properties' not in schema:
                 schema['properties'] = {}
             
-            function_data['parameters'] = schema
-            new_tool['function'] = function_data
-            transformed.append(new_tool)
-        else:
-            transformed.append(tool)
-    return transformed
+            transformed.append({
+                'type': 'function',
+                'function': {'name': name, 'description': description, 'parameters': schema},
+            })
+    return transformed if rebuilt else tools
 
-def validate_max_tokens(data):
+def validate_max_tokens(data: dict | None) -> None:
     """Validate and fix max_tokens to ensure it's >= 1."""
     if not data:
         return
     
     max_tokens = data.get('max_tokens')
-    if not max_tokens or max_tokens == 0:
+    # bool is an int subclass, so check the exact type for the common case.
+    if type(max_tokens) is int and max_tokens >= 1:
+        return
+    if not max_tokens:
         data['max_tokens'] = 1024
         return
     
     try:
-        max_tokens_int = int(float(max_tokens))
+        if isinstance(max_tokens, str) and max_tokens.isdigit():
+            max_tokens_int = int(max_tokens)
+        else:
+            max_tokens_int = int(float(max_tokens))
         data['max_tokens'] = 1024 if max_tokens_int < 1 else max_tokens_int
     except (ValueError, TypeError):
         data['max_tokens'] = 1024
 
 def filter_response_headers(headers):
     """Filter out headers that shouldn't be forwarded."""
-    excluded = {'content-encoding', 'transfer-encoding', 'connection', 'content-length'}
-    return {k: v for k, v in headers.items() if k.lower() not in excluded}
+    return {k: v for k, v in headers.items() if k.lower() not in EXCLUDED_RESPONSE_HEADERS}
+
+def iter_nonempty_body(response):
+    """Return an iterator over the response body, or None if it is empty.
+
+    Only the first chunk is read up front, so the rest of the body can still
+    be relayed without buffering it in memory. Backend errors after that are
+    left to propagate: the server then drops the connection, so the client
+    can tell the body is incomplete.
+    """
+    chunks = response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+    for chunk in chunks:
+        if chunk:
+            return itertools.chain((chunk,), chunks)
+    return None
 
 @app.route('/v1/<path:path>', methods=['GET', 'POST'])
 def proxy(path):
     clean_path = path.lstrip('/')
     backend_url = f"{BACKEND_BASE_URL}/{clean_path}"
     
-    headers = {}
-    for k, v in request.headers.items():
-        if k.lower() != 'host':
-            headers[k] = v
+    # Werkzeug already title-cases incoming header names.
+    headers = {k: v for k, v in request.headers.items() if k != 'Host'}
     
     try:
         stream = False
         if request.method == 'GET':
-            response = requests.get(backend_url, headers=headers, timeout=30)
+            response = SESSION.get(backend_url, headers=headers, timeout=30, stream=True)
         else:
-            data = request.get_json()
+            raw = request.get_data(cache=False)
             if 'Content-Type' not in headers:
                 headers['Content-Type'] = 'application/json'
             
+            # Only chat completions are rewritten; every other body is
+            # forwarded verbatim without a JSON round trip. Client bodies go
+            # through the stdlib json module: orjson rejects lone surrogate
+            # escapes and turns integers beyond 64 bits into floats.
+            body = raw
             if clean_path == 'chat/completions':
+                data = json.loads(raw) if raw else None
+                # The transforms replace top-level fields rather than mutating
+                # them, so a shallow snapshot is enough to tell what changed.
+                original = dict(data) if data else None
                 if data and data.get('model'):
                     incoming_model = str(data.get('model')).lower().replace(' ', '-').replace('--', '-')
-                    normalized_rewrite = REWROTE_MODEL_ID.lower().replace(' ', '-').replace('--', '-')
-                    if incoming_model == normalized_rewrite:
+                    if incoming_model == NORMALIZED_REWRITE_MODEL_ID:
                         data['model'] = ORIGINAL_MODEL_ID
                 
                 if data and 'messages' in data:
@@ -153,48 +245,57 @@ def proxy(path):
                     data['tools'] = transform_tools(data['tools'])
                 if data:
                     validate_max_tokens(data)
+                
+                stream = data.get('stream', False) if data else False
+                if data and (data.keys() != original.keys() or any(data[k] is not v for k, v in original.items())):
+                    body = json.dumps(data).encode()
             
-            stream = data.get('stream', False) if data else False
-            if stream:
-                response = requests.post(backend_url, headers=headers, json=data, timeout=30, stream=True)
-            else:
-                response = requests.post(backend_url, headers=headers, json=data, timeout=30)
+            response = SESSION.post(backend_url, headers=headers, data=body, timeout=30, stream=True)
         
-        if not stream and response.status_code == 200 and len(response.content or []) == 0:
-            try:
-                if not response.text or response.text.strip() == '':
-                    return jsonify({'error': 'Empty response from provider'}), 500
-            except:
-                return jsonify({'error': 'Empty response from provider'}), 500
+        if not stream:
+            stream = response.headers.get('Content-Type', '').startswith('text/event-stream')
         
         if clean_path == 'models' and response.status_code == 200:
+            # The models listing is small, so buffer it for the id rewrite.
+            if not response.content:
+                return jsonify({'error': 'Empty response from provider'}), 500
             try:
-                models_data = response.json()
+                models_data = orjson.loads(response.content)
                 for model in models_data.get('data', []):
                     if model['id'] == ORIGINAL_MODEL_ID:
                         model['id'] = REWROTE_MODEL_ID
-                return jsonify(models_data)
+                return Response(orjson.dumps(models_data), mimetype='application/json')
             except (ValueError, KeyError):
                 pass
         
+        response_headers = filter_response_headers(response.headers)
+        mimetype = None
         if stream and response.status_code == 200:
+            content_type = response.headers.get('Content-Type', 'text/event-stream')
+            
             def generate():
                 try:
-                    for chunk in response.iter_content(chunk_size=8192):
+                    # For chunked responses (how SSE is sent) iter_content yields
+                    # each transfer chunk as it arrives, so events are relayed
+                    # byte for byte without waiting for a full read.
+                    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
                         if chunk:
                             yield chunk
                 except Exception:
                     yield b''
             
-            response_headers = filter_response_headers(response.headers)
-            content_type = response.headers.get('Content-Type', 'text/event-stream')
-            return Response(generate(), mimetype=content_type, status=response.status_code, headers=response_headers)
-        
-        response_headers = filter_response_headers(response.headers)
-        if 'Content-Type' not in response_headers and response.headers.get('Content-Type'):
-            response_headers['Content-Type'] = response.headers.get('Content-Type')
+            body = generate()
+            mimetype = content_type
+        elif response.status_code == 200:
+            body = iter_nonempty_body(response)
+            if body is None:
+                return jsonify({'error': 'Empty response from provider'}), 500
+        else:
+            body = response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
         
-        return response.content, response.status_code, response_headers
+        proxied = Response(body, mimetype=mimetype, status=response.status_code, headers=response_headers)
+        proxied.call_on_close(response.close)
+        return proxied
         
     except requests.exceptions.RequestException as e:
         return jsonify({'error': str(e)}), 500
@@ -1,2 +1,21 @@
+import os
+
 bind = "0.0.0.0:8080"
 workers = 2
+# Proxied calls spend most of their time waiting on the backend (streamed
+# completions can last tens of seconds), so serve them from gevent workers:
+# the worker monkey-patches the stdlib before loading the app, which lets the
+# requests Session yield while it waits on the socket.
+worker_class = "gevent"
+# Shared with app.py, which sizes the backend connection pool to match.
+worker_connections = int(os.environ.get('PROXY_WORKER_CONNECTIONS', 1000))
+
+
+def post_worker_init(worker):
+    # Resolve the backend host and open a pooled keep-alive connection before
+    # the worker takes traffic, so the first proxied calls skip DNS and TLS setup.
+    from app import BACKEND_BASE_URL, SESSION
+    try:
+        SESSION.head(BACKEND_BASE_URL, timeout=5)
+    except Exception as e:
+        worker.log.warning("Backend warm-up failed: %s", e)